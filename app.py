@@ -1,29 +1,64 @@
 import os
-import time
-import base64
-import requests
-import io
+import asyncio
+import logging
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
 import json
-from flask import Flask, render_template, request, jsonify, send_from_directory
+import orjson
+import aiohttp
+from cachetools import TTLCache
+from quart import Quart, Response, render_template, request, jsonify, send_from_directory
+from quart.json.provider import DefaultJSONProvider
 from dotenv import load_dotenv
 import google.generativeai as st_genai
 from google import genai
-from PIL import Image
+from google.genai import types
 
 # Import services
 from services.hd_image_generation import generate_hd_image
-from services.lifestyle_shot import generate_product_shot, lifestyle_shot_by_text, lifestyle_shot_by_image
+from services.lifestyle_shot import generate_product_shot, generate_product_shot_parallel, warm_template_cache, TEMPLATE_DIR
 from services.shadow import add_shadow
 from services.packshot import create_packshot
 from services.background_removal import remove_background
 from services.prompt_enhancement import enhance_prompt
-from utils.image_utils import image_to_base64
+from utils.image_utils import sniff_image_mime, extract_urls
 from utils.text_overlay import add_cta_to_image
+from utils.http_client import get_session, close_session, is_http_url, fetch_public_url
 
 # Load environment variables
 load_dotenv()
 
-app = Flask(__name__)
+def _configure_logging():
+    """Route log records through a queue so the write happens off the request path"""
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    root = logging.getLogger()
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    return listener
+
+_LOG_LISTENER = _configure_logging()
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Serve JSON responses through orjson instead of the stdlib encoder"""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+app = Quart(__name__)
+app.json = OrjsonProvider(app)
 UPLOAD_FOLDER = 'static/uploads'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -33,68 +68,128 @@ BRIA_API_KEY = os.getenv("BRIA_API_KEY")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 st_genai.configure(api_key=GOOGLE_API_KEY)
 
+# Veo polling (seconds)
+VIDEO_POLL_TIMEOUT = 420
+VIDEO_POLL_INITIAL_DELAY = 10
+VIDEO_POLL_MAX_DELAY = 30
+
+# Browser/proxy cache lifetime for /assets/templates/* (7 days)
+TEMPLATE_CACHE_SECONDS = 7 * 24 * 3600
+
+BRIA_BASE_URL = "https://engine.prod.bria-api.com/"
+
+# Fan sync lifestyle requests out as one Bria call per result (lower latency,
+# but N uploads and N concurrent Bria jobs per request). Off by default.
+LIFESTYLE_FAN_OUT = os.getenv("LIFESTYLE_FAN_OUT", "").lower() in ("1", "true", "yes")
+
+# Downloaded images by URL (bytes, ETag); bounded by total bytes, 10 min TTL.
+# Multi-step flows (remove bg -> packshot -> lifestyle) reuse the same URL.
+_DOWNLOAD_CACHE = TTLCache(maxsize=256 * 1024 * 1024, ttl=600, getsizeof=lambda entry: len(entry[0]))
+
+# Limits for fetching user-supplied image URLs
+MAX_DOWNLOAD_BYTES = 25 * 1024 * 1024
+DOWNLOAD_TIMEOUT = aiohttp.ClientTimeout(total=30, sock_connect=3)
+
+# Strong refs for fire-and-forget startup tasks
+_BACKGROUND_TASKS = set()
+
+async def _prewarm_bria():
+    """Open a keep-alive connection to Bria so the first request skips DNS/TLS setup"""
+    try:
+        async with get_session().head(BRIA_BASE_URL, timeout=aiohttp.ClientTimeout(total=5)):
+            pass
+    except Exception as e:
+        print(f"Bria pre-warm failed: {e}")
+
+def _log_warm_result(future):
+    """Report a failed template warm-up instead of leaving it unretrieved"""
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Template cache warm-up failed: {future.exception()}")
+
+@app.before_serving
+async def startup():
+    loop = asyncio.get_running_loop()
+    # Worker pool behind asyncio.to_thread (base64, PIL, sync SDK calls)
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=32, thread_name_prefix='rapidad'))
+    # Encode templates in the background; requests don't wait on it
+    warm = loop.run_in_executor(None, warm_template_cache)
+    _BACKGROUND_TASKS.add(warm)
+    warm.add_done_callback(_log_warm_result)
+    warm.add_done_callback(_BACKGROUND_TASKS.discard)
+    task = asyncio.create_task(_prewarm_bria())
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_BACKGROUND_TASKS.discard)
+
+@app.after_serving
+async def shutdown():
+    await close_session()
+    _LOG_LISTENER.stop()
+
 # --- UTILS ---
-def download_image(url):
-    if not url: return None
+async def download_image(url):
+    if not url or not is_http_url(url): return None
+    cached = _DOWNLOAD_CACHE.get(url)
+    if cached and not cached[1]:
+        return cached[0]
+    # With an ETag, revalidate: a 304 costs a round-trip but no body
+    headers = {'If-None-Match': cached[1]} if cached else None
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        return response.content
+        response, content = await fetch_public_url(url, MAX_DOWNLOAD_BYTES, DOWNLOAD_TIMEOUT, headers=headers)
+        if content is None:
+            return cached[0] if cached else None
+        _DOWNLOAD_CACHE[url] = (content, response.headers.get('ETag'))
+        return content
     except Exception as e:
         print(f"Download failed: {e}")
         return None
 
-def _extract_urls(data):
-    """Robustly extract all image URLs from various Bria response formats"""
-    urls = []
-    if not isinstance(data, dict): return urls
-    if "result_urls" in data and isinstance(data["result_urls"], list):
-        urls.extend(data["result_urls"])
-    elif "result_url" in data:
-        urls.append(data["result_url"])
-    elif "result" in data and isinstance(data["result"], list):
-        for item in data["result"]:
-            if isinstance(item, dict):
-                if "urls" in item and len(item["urls"]) > 0: urls.append(item["urls"][0])
-                elif "url" in item: urls.append(item["url"])
-            elif isinstance(item, list) and len(item) > 0: urls.append(item[0])
-            elif isinstance(item, str): urls.append(item)
-    elif "urls" in data and isinstance(data["urls"], list):
-        urls.extend(data["urls"])
-    return urls
-
-# --- FLASK ROUTES ---
+async def _json_payload():
+    """The request body as a JSON object, or None when it is missing or malformed"""
+    payload = await request.get_json(force=True, silent=True)
+    return payload if isinstance(payload, dict) else None
+
+@lru_cache(maxsize=1)
+def _list_templates(dir_mtime):
+    """Template file names; keyed on the directory mtime so adds/removes invalidate it"""
+    with os.scandir(TEMPLATE_DIR) as entries:
+        return [e.name for e in entries if e.is_file() and e.name.endswith(('.png', '.jpg', '.jpeg'))]
+
+# --- ROUTES ---
 @app.route('/api/list_templates')
-def api_list_templates():
-    template_dir = os.path.join('assets', 'templates')
-    if not os.path.exists(template_dir):
+async def api_list_templates():
+    try:
+        dir_mtime = os.stat(TEMPLATE_DIR).st_mtime
+    except FileNotFoundError:
         return jsonify([])
-    templates = [f for f in os.listdir(template_dir) if f.endswith(('.png', '.jpg', '.jpeg'))]
-    return jsonify(templates)
+    return jsonify(_list_templates(dir_mtime))
 
 @app.route('/assets/templates/<path:filename>')
-def serve_template(filename):
-    return send_from_directory('assets/templates', filename)
+async def serve_template(filename):
+    # Dev/fallback path only; in production nginx serves these with sendfile
+    # (see README). Templates are static, so let browsers and proxies cache them.
+    return await send_from_directory(TEMPLATE_DIR, filename, cache_timeout=TEMPLATE_CACHE_SECONDS)
 
 @app.route('/')
-def index():
-    return render_template('index.html')
+async def index():
+    return await render_template('index.html')
 
 @app.route('/api/generate_hd', methods=['POST'])
-def api_generate_hd():
-    prompt = request.json.get('prompt')
-    aspect_ratio = request.json.get('aspect_ratio', '1:1')
-    style = request.json.get('style', 'photography')
+async def api_generate_hd():
+    payload = await _json_payload()
+    if payload is None: return jsonify({"error": "Expected a JSON object body"}), 400
+    prompt = payload.get('prompt')
+    aspect_ratio = payload.get('aspect_ratio', '1:1')
+    style = payload.get('style', 'photography')
     
     try:
-        result = generate_hd_image(
+        result = await generate_hd_image(
             prompt=prompt,
             api_key=BRIA_API_KEY,
             aspect_ratio=aspect_ratio,
             medium=style,
             sync=True
         )
-        urls = _extract_urls(result)
+        urls = extract_urls(result)
         return jsonify({
             "urls": urls,
             "result_url": urls[0] if urls else None,
@@ -104,53 +199,62 @@ def api_generate_hd():
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/enhance_prompt', methods=['POST'])
-def api_enhance():
-    prompt = request.json.get('prompt')
+async def api_enhance():
+    payload = await _json_payload()
+    if payload is None: return jsonify({"error": "Expected a JSON object body"}), 400
+    prompt = payload.get('prompt')
     try:
         # We can still use st_genai here if Bria service is not available
         # or just stick to the original plan of Bria if enhance_prompt is imported
-        result = enhance_prompt(BRIA_API_KEY, prompt)
+        result = await asyncio.to_thread(enhance_prompt, BRIA_API_KEY, prompt)
         return jsonify({"enhanced_prompt": result})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/process_photography', methods=['POST'])
-def api_process_photography():
-    image_url = request.form.get('image_url')
-    image_file = request.files.get('image')
-    operation = request.form.get('operation')
+async def api_process_photography():
+    form = await request.form
+    files = await request.files
+    image_url = form.get('image_url')
+    image_file = files.get('image')
+    operation = form.get('operation')
     
     if image_file:
         img_bytes = image_file.read()
     elif image_url:
-        img_bytes = download_image(image_url)
+        if not is_http_url(image_url): return jsonify({"error": "Invalid image_url"}), 400
+        # Background removal hands Bria the URL itself, so skip the download
+        img_bytes = None if operation == "remove_bg" else await download_image(image_url)
+        if operation != "remove_bg" and not img_bytes: return jsonify({"error": "Failed to get image"}), 400
     else:
         return jsonify({"error": "No image provided"}), 400
 
     try:
         if operation == "remove_bg":
             if image_url:
-                result = remove_background(BRIA_API_KEY, image_url=image_url)
+                result = await remove_background(BRIA_API_KEY, image_url=image_url)
             else:
-                result = remove_background(BRIA_API_KEY, image_data=img_bytes)
+                result = await remove_background(BRIA_API_KEY, image_data=img_bytes)
         elif operation == "packshot":
-            bg_color = request.form.get('bg_color', '#FFFFFF')
-            result = create_packshot(BRIA_API_KEY, img_bytes, background_color=bg_color)
+            bg_color = form.get('bg_color', '#FFFFFF')
+            result = await asyncio.to_thread(create_packshot, BRIA_API_KEY, img_bytes, background_color=bg_color)
         elif operation == "shadow":
-            intensity = int(request.form.get('intensity', 60))
-            result = add_shadow(BRIA_API_KEY, img_bytes, shadow_intensity=intensity)
+            intensity = int(form.get('intensity', 60))
+            result = await asyncio.to_thread(add_shadow, BRIA_API_KEY, img_bytes, shadow_intensity=intensity)
         elif operation == "lifestyle":
-            prompt = request.form.get('prompt', '')
-            ref_url = request.form.get('ref_url')
+            prompt = form.get('prompt', '')
+            ref_url = form.get('ref_url')
             
             # If ref_url is a relative template path, make it absolute or ensure it's relative to app root
             if ref_url and ref_url.startswith('/assets/templates/'):
                 ref_url = ref_url.lstrip('/')
             
-            # Use the consolidated generate_product_shot which handles ref image
-            result = generate_product_shot(
+            # Use the consolidated generate_product_shot which handles ref image;
+            # the parallel variant fans the sync multi-result request out concurrently
+            shot = generate_product_shot_parallel if LIFESTYLE_FAN_OUT else generate_product_shot
+            result = await shot(
                 api_key=BRIA_API_KEY,
-                image_data=image_to_base64(img_bytes),
+                image_data=img_bytes,
                 ref_image_data=ref_url if ref_url else None,
                 scene_description=prompt,
                 gemini_api_key=GOOGLE_API_KEY,
@@ -162,7 +266,7 @@ def api_process_photography():
         else:
             return jsonify({"error": "Invalid operation"}), 400
         
-        urls = _extract_urls(result)
+        urls = extract_urls(result)
         return jsonify({
             "urls": urls,
             "result_url": urls[0] if urls else (result.get('result_url') if isinstance(result, dict) else None),
@@ -174,34 +278,46 @@ def api_process_photography():
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/cta_overlay', methods=['POST'])
-def api_cta_overlay():
-    image_url = request.json.get('image_url')
-    headline = request.json.get('headline', '')
-    subheadline = request.json.get('subheadline', '')
+async def api_cta_overlay():
+    payload = await _json_payload()
+    if payload is None: return jsonify({"error": "Expected a JSON object body"}), 400
+    image_url = payload.get('image_url')
+    headline = payload.get('headline', '')
+    subheadline = payload.get('subheadline', '')
     
-    img_bytes = download_image(image_url)
+    if not is_http_url(image_url): return jsonify({"error": "Invalid image_url"}), 400
+    img_bytes = await download_image(image_url)
     if not img_bytes: return jsonify({"error": "Failed to get image"}), 400
     
     try:
-        result_bytes = add_cta_to_image(img_bytes, headline, subheadline)
-        b64 = base64.b64encode(result_bytes).decode('utf-8')
-        return jsonify({"result_b64": f"data:image/png;base64,{b64}"})
+        result_bytes = await asyncio.to_thread(add_cta_to_image, img_bytes, headline, subheadline)
+        # Raw image bytes instead of a base64 JSON envelope; the overlay is deterministic
+        # for (image_url, headline, subheadline), so let caches keep it
+        response = Response(result_bytes, mimetype=sniff_image_mime(result_bytes))
+        response.headers['Cache-Control'] = 'public, max-age=3600'
+        return response
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/generate_video', methods=['POST'])
-def api_generate_video():
-    image_url = request.json.get('image_url')
-    prompt = request.json.get('prompt')
-    aspect_ratio = request.json.get('aspect_ratio', '16:9')
-    duration = request.json.get('duration', '5')
+async def api_generate_video():
+    payload = await _json_payload()
+    if payload is None: return jsonify({"error": "Expected a JSON object body"}), 400
+    image_url = payload.get('image_url')
+    prompt = payload.get('prompt')
+    aspect_ratio = payload.get('aspect_ratio', '16:9')
+    duration = payload.get('duration', '5')
     
     if not image_url or not prompt:
         return jsonify({"error": "Missing data"}), 400
+    if not is_http_url(image_url):
+        return jsonify({"error": "Invalid image_url"}), 400
 
     try:
-        img_bytes = download_image(image_url)
-        img = Image.open(io.BytesIO(img_bytes))
+        img_bytes = await download_image(image_url)
+        if not img_bytes: return jsonify({"error": "Failed to get image"}), 400
+        # Hand the encoded bytes straight to the SDK; no PIL decode/re-encode
+        img = types.Image(image_bytes=img_bytes, mime_type=sniff_image_mime(img_bytes))
         
         # Using the new google-genai v1 SDK for Veo 3.1
         client = genai.Client(api_key=GOOGLE_API_KEY, http_options={'api_version': 'v1alpha'})
@@ -213,23 +329,28 @@ def api_generate_video():
         }
         
         # Trigger generation
-        operation = client.models.generate_videos(
+        operation = await client.aio.models.generate_videos(
             model='veo-3.1-generate-001',
             prompt=prompt,
             image=img,
             config=config
         )
+        print(f"Veo operation started: {operation.name}")
         
-        # Async polling (10s intervals)
-        for _ in range(40): # ~7 mins max
-            time.sleep(10)
-            status = client.operations.get(name=operation.name)
+        # Async polling with backoff (10s -> 15s -> 22s -> 30s cap)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + VIDEO_POLL_TIMEOUT
+        delay = VIDEO_POLL_INITIAL_DELAY
+        while loop.time() < deadline:
+            await asyncio.sleep(delay)
+            status = await client.aio.operations.get(operation)
             if status.done:
                 if status.error:
                     return jsonify({"error": str(status.error)}), 500
                 return jsonify({"video_url": status.response.generated_videos[0].video.uri})
+            delay = min(delay * 1.5, VIDEO_POLL_MAX_DELAY)
         
-        return jsonify({"error": "Timeout"}), 504
+        return jsonify({"error": "Timeout", "operation": operation.name}), 504
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -1,29 +1,41 @@
 import os
+import asyncio
+import shutil
 import requests
 from dotenv import load_dotenv
 from services.background_removal import remove_background
+from utils.http_client import close_session
 
 load_dotenv()
 BRIA_API_KEY = os.getenv("BRIA_API_KEY")
 
+async def _remove_background(image_data):
+    # Close the shared aiohttp session before the loop goes away
+    try:
+        return await remove_background(BRIA_API_KEY, image_data=image_data)
+    finally:
+        await close_session()
+
 def fix_logo():
     logo_path = r"c:\Projects 2025\adsnap\adsnap-flask-pro\static\rapid-logo.png"
     with open(logo_path, "rb") as f:
         img_bytes = f.read()
     
     print("Removing background from logo...")
-    result = remove_background(BRIA_API_KEY, image_data=img_bytes)
+    result = asyncio.run(_remove_background(img_bytes))
     
     if "result_url" in result:
         url = result["result_url"]
         print(f"Success! Result URL: {url}")
-        resp = requests.get(url)
-        if resp.status_code == 200:
-            with open(logo_path, "wb") as f:
-                f.write(resp.content)
-            print("Logo updated with transparent background.")
-        else:
-            print("Failed to download processed logo.")
+        # Stream straight to disk instead of buffering the whole body
+        with requests.get(url, stream=True) as resp:
+            if resp.status_code == 200:
+                resp.raw.decode_content = True
+                with open(logo_path, "wb") as f:
+                    shutil.copyfileobj(resp.raw, f, length=64 * 1024)
+                print("Logo updated with transparent background.")
+            else:
+                print("Failed to download processed logo.")
     else:
         print(f"Failed to remove background: {result}")
 
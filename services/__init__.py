@@ -1,21 +1,23 @@
-from .lifestyle_shot import lifestyle_shot_by_text, lifestyle_shot_by_image, generate_product_shot
+from .lifestyle_shot import lifestyle_shot_by_text, lifestyle_shot_by_image, generate_product_shot, generate_product_shot_parallel
 from .shadow import add_shadow
 from .packshot import create_packshot
 from .prompt_enhancement import enhance_prompt
 from .generative_fill import generative_fill
 from .hd_image_generation import generate_hd_image
 from .erase_foreground import erase_foreground
-from .puter_video import generate_video_with_puter
+from .puter_video import generate_video_with_puter, generate_video_with_puter_async
 
 __all__ = [
     'lifestyle_shot_by_text',
     'lifestyle_shot_by_image',
     'generate_product_shot',
+    'generate_product_shot_parallel',
     'add_shadow',
     'create_packshot',
     'enhance_prompt',
     'generative_fill',
     'generate_hd_image',
     'erase_foreground',
-    'generate_video_with_puter'
+    'generate_video_with_puter',
+    'generate_video_with_puter_async'
 ]
\ No newline at end of file
@@ -1,8 +1,21 @@
 from typing import Dict, Any
-import requests
-import base64
+import os
+import aiohttp
+import orjson
+from utils.http_client import get_session
+from utils.image_utils import sniff_image_mime
 
-def remove_background(
+# Bria has served this operation from several paths; tried in order on a 400
+BG_REMOVE_URLS = [
+    "https://engine.prod.bria-api.com/v1/background/remove",
+    "https://engine.prod.bria-api.com/v1/remove_background",
+    "https://engine.prod.bria-api.com/v2/background/remove",
+]
+
+# Last endpoint that answered successfully; tried first on the next call
+_WORKING_URL = None
+
+async def remove_background(
     api_key: str,
     image_data: bytes = None,
     image_url: str = None,
@@ -21,13 +34,18 @@ def remove_background(
     Returns:
         Dict containing the API response
     """
-    # Try the most common endpoint first
-    url = "https://engine.prod.bria-api.com/v1/background/remove"
+    global _WORKING_URL
+    
+    # BRIA_BG_REMOVE_URL pins the endpoint so production never probes
+    forced_url = os.getenv("BRIA_BG_REMOVE_URL")
+    if forced_url:
+        candidates = [forced_url]
+    else:
+        candidates = list(dict.fromkeys(u for u in [_WORKING_URL, *BG_REMOVE_URLS] if u))
     
     headers = {
         'api_token': api_key,
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
+        'Accept': 'application/json'
     }
     
     # Prepare request data
@@ -38,36 +56,44 @@ def remove_background(
     
     if image_url:
         data['image_url'] = image_url
-    elif image_data:
-        data['file'] = base64.b64encode(image_data).decode('utf-8')
-    else:
+    elif not image_data:
         raise ValueError("Either image_data or image_url must be provided")
+
+    def _request_kwargs():
+        # URLs go as JSON; raw bytes are streamed as multipart instead of base64.
+        # FormData can only be sent once, so build a fresh one per attempt.
+        if image_url:
+            return {'data': orjson.dumps(data), 'headers': {**headers, 'Content-Type': 'application/json'}}
+        form = aiohttp.FormData()
+        for key, value in data.items():
+            form.add_field(key, str(value).lower())
+        mime_type = sniff_image_mime(image_data)
+        form.add_field('file', image_data, filename='image.' + mime_type.split('/')[1], content_type=mime_type)
+        return {'data': form, 'headers': headers}
     
+    session = get_session()
     try:
-        print(f"Making request to: {url}")
-        response = requests.post(url, headers=headers, json=data)
-        
-        # If 400, try alternative endpoints
-        if response.status_code == 400:
-            print("Primary endpoint failed with 400, trying alternative v1/remove_background...")
-            alt_url = "https://engine.prod.bria-api.com/v1/remove_background"
-            response = requests.post(alt_url, headers=headers, json=data)
+        for url in candidates:
+            print(f"Making request to: {url}")
+            response = await session.post(url, **_request_kwargs())
             
-            if response.status_code == 400:
-                print("Alternative 1 failed, trying v2/background/remove...")
-                alt_url_v2 = "https://engine.prod.bria-api.com/v2/background/remove"
-                response = requests.post(alt_url_v2, headers=headers, json=data)
+            # If 400, try the next endpoint
+            if response.status != 400 or url == candidates[-1]:
+                break
+            print(f"{url} failed with 400, trying next endpoint...")
+            response.release()
 
-        if response.status_code != 200:
-            print(f"Bria Error Status: {response.status_code}")
-            print(f"Bria Error Response: {response.text}")
-        
-        response.raise_for_status()
-        
-        print(f"Response status: {response.status_code}")
-        return response.json()
+        async with response:
+            if response.status != 200:
+                error_text = await response.text()
+                print(f"Bria Error Status: {response.status}")
+                print(f"Bria Error Response: {error_text}")
+                if response.status >= 400:
+                    raise Exception(f"{response.status} - {error_text}")
+            
+            print(f"Response status: {response.status}")
+            result = await response.json(content_type=None, loads=orjson.loads)
+            _WORKING_URL = url
+            return result
     except Exception as e:
-        error_msg = str(e)
-        if hasattr(e, 'response') and e.response is not None:
-             error_msg = f"{e.response.status_code} - {e.response.text}"
-        raise Exception(f"Background removal failed: {error_msg}")
+        raise Exception(f"Background removal failed: {str(e)}")
@@ -1,6 +1,7 @@
 from typing import Dict, Any, Optional
-import requests
+import orjson
 import base64
+from utils.http_client import BRIA_SESSION
 
 def erase_foreground(
     api_key: str,
@@ -43,7 +44,7 @@ def erase_foreground(
         print(f"Headers: {headers}")
         print(f"Data: {data}")
         
-        response = requests.post(url, headers=headers, json=data)
+        response = BRIA_SESSION.post(url, headers=headers, data=orjson.dumps(data))
         response.raise_for_status()
         
         print(f"Response status: {response.status_code}")
@@ -1,8 +1,8 @@
 from typing import Dict, Any, Optional, Union
-import requests
-import json
+import orjson
+from utils.http_client import get_session
 
-def generate_hd_image(
+async def generate_hd_image(
     prompt: str,
     api_key: str,
     model_version: str = "2.2",
@@ -81,13 +81,13 @@ def generate_hd_image(
         print(f"Making request to: {url}")
         print(f"Headers: {headers}")
         
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
-        
-        print(f"Response status: {response.status_code}")
-        print(f"Response body: {response.text}")
-        
-        return response.json()
+        async with get_session().post(url, headers=headers, data=orjson.dumps(data)) as response:
+            response.raise_for_status()
+            
+            print(f"Response status: {response.status}")
+            print(f"Response body: {await response.text()}")
+            
+            return await response.json(content_type=None, loads=orjson.loads)
         
     except Exception as e:
         raise Exception(f"HD image generation failed: {str(e)}") 
\ No newline at end of file
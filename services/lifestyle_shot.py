@@ -1,15 +1,83 @@
-from typing import Dict, Any, Optional, List
-import requests
+from typing import Dict, Any, Optional, List, Union
+import asyncio
 import base64
+import logging
+import aiohttp
+import orjson
 import os
-import io
-from PIL import Image
+import threading
+from cachetools import LRUCache
+from utils.http_client import get_session, fetch_public_url
+from utils.image_utils import extract_urls, sniff_image_mime
 try:
     import google.generativeai as genai
 except ImportError:
     genai = None
 
-def merge_vision_and_prompt(
+logger = logging.getLogger(__name__)
+
+TEMPLATE_DIR = os.path.join('assets', 'templates')
+
+# Limits for fetching a user-supplied reference image URL
+MAX_REF_IMAGE_BYTES = 25 * 1024 * 1024
+REF_IMAGE_TIMEOUT = aiohttp.ClientTimeout(total=30, sock_connect=3)
+
+# Gemini model reused across merges; rebuilt only when the API key changes
+_GEMINI_MODEL = None
+_GEMINI_KEY = None
+_GEMINI_LOCK = threading.Lock()
+
+def _get_gemini_model(gemini_api_key: str):
+    global _GEMINI_MODEL, _GEMINI_KEY
+    with _GEMINI_LOCK:
+        if _GEMINI_MODEL is None or _GEMINI_KEY != gemini_api_key:
+            genai.configure(api_key=gemini_api_key)
+            _GEMINI_MODEL = genai.GenerativeModel('gemini-1.5-pro')
+            _GEMINI_KEY = gemini_api_key
+        return _GEMINI_MODEL
+
+def _template_path(path: str) -> Optional[str]:
+    """Resolve a local reference path; only files inside TEMPLATE_DIR are allowed."""
+    root = os.path.realpath(TEMPLATE_DIR)
+    resolved = os.path.realpath(path.lstrip('/'))
+    if os.path.commonpath([root, resolved]) != root or not os.path.isfile(resolved):
+        return None
+    return resolved
+
+# Base64 (as str) of template files keyed by (path, mtime), so edited files are
+# re-read; bounded by total characters held rather than entry count
+TEMPLATE_CACHE_BYTES = 64 * 1024 * 1024
+_TEMPLATE_CACHE = LRUCache(maxsize=TEMPLATE_CACHE_BYTES, getsizeof=len)
+_TEMPLATE_LOCK = threading.Lock()
+
+def _template_b64(path: str) -> str:
+    """Base64 of a template file. Blocking: call via asyncio.to_thread."""
+    key = (path, os.path.getmtime(path))
+    with _TEMPLATE_LOCK:
+        cached = _TEMPLATE_CACHE.get(key)
+    if cached is not None:
+        return cached
+    with open(path, "rb") as f:
+        encoded = base64.b64encode(f.read()).decode('ascii')
+    if len(encoded) <= TEMPLATE_CACHE_BYTES:
+        with _TEMPLATE_LOCK:
+            _TEMPLATE_CACHE[key] = encoded
+    return encoded
+
+def warm_template_cache(template_dir: str = TEMPLATE_DIR) -> None:
+    """Pre-encode templates (until the cache budget is used) so lifestyle requests skip the disk read."""
+    if not os.path.isdir(template_dir):
+        return
+    for name in sorted(os.listdir(template_dir)):
+        path = os.path.join(template_dir, name)
+        if not os.path.isfile(path):
+            continue
+        # Stop rather than evict what was just warmed
+        if _TEMPLATE_CACHE.currsize + (os.path.getsize(path) + 2) // 3 * 4 > TEMPLATE_CACHE_BYTES:
+            break
+        _template_b64(path)
+
+async def merge_vision_and_prompt(
     gemini_api_key: str,
     ref_image_data: str,  # Base64 or URL
     user_prompt: str
@@ -22,23 +90,42 @@ def merge_vision_and_prompt(
         return user_prompt
 
     try:
-        genai.configure(api_key=gemini_api_key)
-        model = genai.GenerativeModel('gemini-1.5-pro')
+        model = _get_gemini_model(gemini_api_key)
         
-        # Prepare the image for Gemini
+        # Prepare the image for Gemini as an inline blob; the SDK takes the
+        # encoded bytes as-is, so there's no need to decode them with PIL
         img = None
         if ref_image_data.startswith('data:image'):
             base64_data = ref_image_data.split(",", 1)[1]
-            img = Image.open(io.BytesIO(base64.b64decode(base64_data)))
+            raw = await asyncio.to_thread(base64.b64decode, base64_data)
+            mime_type = sniff_image_mime(raw, default=None)
+            if mime_type is None:
+                raise ValueError("reference data URI is not an image")
+            img = {'mime_type': mime_type, 'data': raw}
         elif ref_image_data.startswith('http'):
             # For brevity, Gemini 1.5 Pro handles URLs via its own ecosystem 
-            # or we fetch it. Let's fetch it for reliability.
-            response = requests.get(ref_image_data)
-            img = Image.open(io.BytesIO(response.content))
+            # or we fetch it. Let's fetch it for reliability -- through the SSRF
+            # guard, with a timeout and size cap; error statuses raise.
+            response, content = await fetch_public_url(ref_image_data, MAX_REF_IMAGE_BYTES, REF_IMAGE_TIMEOUT)
+            if content is None:
+                raise ValueError(f"no body fetching reference image {ref_image_data}")
+            mime_type = response.headers.get('Content-Type', '').split(';')[0]
+            if not mime_type.startswith('image/'):
+                mime_type = sniff_image_mime(content, default=None)
+                if mime_type is None:
+                    raise ValueError(f"reference URL did not return an image ({ref_image_data})")
+            img = {'mime_type': mime_type, 'data': content}
         else:
-            # Assume local path if not URL/Base64
-            if os.path.exists(ref_image_data):
-                img = Image.open(ref_image_data)
+            # Assume local path if not URL/Base64; only bundled templates may be read
+            path = _template_path(ref_image_data)
+            if path is None:
+                raise ValueError(f"reference path is not a template: {ref_image_data}")
+            with open(path, 'rb') as f:
+                raw = await asyncio.to_thread(f.read)
+            mime_type = sniff_image_mime(raw, default=None)
+            if mime_type is None:
+                raise ValueError(f"reference file is not an image: {ref_image_data}")
+            img = {'mime_type': mime_type, 'data': raw}
 
         prompt_text = f"""
         Act as a Professional Product Photographer.
@@ -56,12 +143,12 @@ def merge_vision_and_prompt(
         if img:
             content.append(img)
             
-        response = model.generate_content(content)
+        response = await model.generate_content_async(content)
         return response.text.strip()
     except Exception as e:
         print(f"Gemini prompt merging failed: {str(e)}")
         return user_prompt
-def lifestyle_shot_by_text(
+async def lifestyle_shot_by_text(
     api_key: str,
     image_data: bytes,
     scene_description: str,
@@ -113,7 +200,7 @@ def lifestyle_shot_by_text(
     }
     
     # Convert image to base64
-    image_base64 = base64.b64encode(image_data).decode('utf-8')
+    image_base64 = await asyncio.to_thread(lambda: base64.b64encode(image_data).decode('ascii'))
     
     # Prepare request data
     data = {
@@ -156,19 +243,19 @@ def lifestyle_shot_by_text(
         print(f"Headers: {headers}")
         print(f"Data: {data}")
         
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
-        
-        print(f"Response status: {response.status_code}")
-        print(f"Response body: {response.text}")
-        
-        return response.json()
+        async with get_session().post(url, headers=headers, data=orjson.dumps(data)) as response:
+            response.raise_for_status()
+            
+            print(f"Response status: {response.status}")
+            print(f"Response body: {await response.text()}")
+            
+            return await response.json(content_type=None, loads=orjson.loads)
     except Exception as e:
         raise Exception(f"Lifestyle shot generation failed: {str(e)}")
 
-def generate_product_shot(
+async def _build_product_shot_request(
     api_key: str,
-    image_data: str,  # Base64 string (with data: prefix) or URL
+    image_data: Union[bytes, str],  # Raw bytes, base64 string (with data: prefix) or URL
     ref_image_data: str,  # Base64 string (with data: prefix) or URL
     scene_description: str = None,
     gemini_api_key: str = None,  # For Smart Prompt Merger
@@ -176,10 +263,9 @@ def generate_product_shot(
     sync: bool = False,
     force_rmbg: bool = False,
     content_moderation: bool = False
-) -> Dict[str, Any]:
+):
     """
-    Generate a lifestyle shot using Bria's best available endpoint.
-    If BOTH prompt and reference are provided, uses Gemini to merge them.
+    Resolve the Bria endpoint, headers and payload for a product shot.
     """
     headers = {
         'api_token': api_key,
@@ -188,7 +274,7 @@ def generate_product_shot(
     }
 
     # Prepare standard image parameter
-    def _prepare_image(data: str):
+    async def _prepare_image(data: str):
         if not data: return None, None
         if data.startswith('data:image'):
             try:
@@ -199,13 +285,12 @@ def generate_product_shot(
         elif data.startswith('http'):
             return 'url', data
         else:
-            # Check if it's a local file (strip leading slash if present for relative path)
-            clean_path = data.lstrip('/')
-            if os.path.exists(clean_path):
+            # Check if it's a bundled template (strip leading slash if present for relative path)
+            clean_path = _template_path(data)
+            if clean_path:
                 try:
-                    with open(clean_path, "rb") as f:
-                        b64 = base64.b64encode(f.read()).decode('utf-8')
-                        return 'file', b64
+                    # Disk read + encode on a miss; off the event loop either way
+                    return 'file', await asyncio.to_thread(_template_b64, clean_path)
                 except Exception as e:
                     print(f"Failed to read local file {clean_path}: {e}")
             
@@ -219,9 +304,13 @@ def generate_product_shot(
         'force_rmbg': force_rmbg,
         'content_moderation': content_moderation
     }
-    prod_key, prod_val = _prepare_image(image_data)
-    if prod_key == 'file': data['file'] = prod_val
-    else: data['image_url'] = prod_val
+    if isinstance(image_data, bytes):
+        # Raw upload: encode exactly once instead of via a data: URL round-trip
+        data['file'] = await asyncio.to_thread(lambda: base64.b64encode(image_data).decode('ascii'))
+    else:
+        prod_key, prod_val = await _prepare_image(image_data)
+        if prod_key == 'file': data['file'] = prod_val
+        else: data['image_url'] = prod_val
 
     # DEFINE THE DEFAULT STUDIO PROMPT
     DEFAULT_PROMPT = "High-end studio product photography, professional lighting, photorealistic, integrated shadows, 8k."
@@ -235,14 +324,14 @@ def generate_product_shot(
     if not is_custom_prompt and ref_image_data:
         print("🎯 Using Exact Composition route (by_image)...")
         url = "https://engine.prod.bria-api.com/v1/product/lifestyle_shot_by_image"
-        ref_key, ref_val = _prepare_image(ref_image_data)
+        ref_key, ref_val = await _prepare_image(ref_image_data)
         if ref_key == 'file': data['ref_image_file'] = ref_val
         else: data['ref_image_url'] = ref_val
         
     # 2. CREATIVE MERGE: use Gemini + by_text if custom prompt provided.
     elif is_custom_prompt and ref_image_data and gemini_api_key:
         print("🤖 Gemini is merging your template and custom prompt...")
-        merged_prompt = merge_vision_and_prompt(
+        merged_prompt = await merge_vision_and_prompt(
             gemini_api_key, 
             ref_image_data, 
             scene_description
@@ -262,7 +351,7 @@ def generate_product_shot(
         # Fallback to image route if somehow prompt is default but image provided
         url = "https://engine.prod.bria-api.com/v1/product/lifestyle_shot_by_image"
         if ref_image_data:
-            ref_key, ref_val = _prepare_image(ref_image_data)
+            ref_key, ref_val = await _prepare_image(ref_image_data)
             if ref_key == 'file': data['ref_image_file'] = ref_val
             else: data['ref_image_url'] = ref_val
 
@@ -271,39 +360,104 @@ def generate_product_shot(
     # the user is likely providing a centered cutout.
     data['placement_type'] = 'original'
 
-    # DEBUG LOGGING
-    print(f"--- Bria Request Debug ---")
-    print(f"URL: {url}")
-    print(f"Custom Prompt: {is_custom_prompt}")
-    print(f"Data Keys: {list(data.keys())}")
-    # Don't print full base64 strings as they are too huge, just lengths
-    if 'file' in data: print(f"File length: {len(data['file'])}")
-    if 'ref_image_file' in data: print(f"Ref Image length: {len(data['ref_image_file'])}")
-    if 'scene_description' in data: print(f"Scene Description: {data['scene_description']}")
-    print(f"--------------------------")
+    # DEBUG LOGGING (one record; skipped entirely unless DEBUG is enabled)
+    # Don't log full base64 strings as they are too huge, just lengths
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            'bria_request url=%s custom=%s keys=%s file_len=%s ref_len=%s scene=%r',
+            url, is_custom_prompt, list(data.keys()),
+            len(data['file']) if 'file' in data else None,
+            len(data['ref_image_file']) if 'ref_image_file' in data else None,
+            data.get('scene_description')
+        )
+
+    return url, headers, data
 
+async def _post_product_shot(url: str, headers: Dict[str, str], body: bytes) -> Dict[str, Any]:
     try:
-        response = requests.post(url, headers=headers, json=data)
-        
-        # LOGGING
-        print(f"Bria Request to {url}")
-        print(f"Bria Status: {response.status_code}")
-        
-        response.raise_for_status()
-        return response.json()
+        async with get_session().post(url, headers=headers, data=body) as response:
+            logger.info('bria_response url=%s status=%s', url, response.status)
+            
+            if response.status >= 400:
+                response_text = await response.text()
+                try:
+                    error_json = orjson.loads(response_text)
+                    return {"error": error_json, "status_code": response.status, "url_attempted": url}
+                except ValueError:
+                    return {"error": response_text, "status_code": response.status, "url_attempted": url}
+            return await response.json(content_type=None, loads=orjson.loads)
     except Exception as e:
-        status_code = getattr(e.response, "status_code", 400) if hasattr(e, "response") and e.response is not None else 400
-        try:
-            response_text = e.response.text if hasattr(e, "response") and e.response is not None else str(e)
-            try:
-                error_json = e.response.json()
-                return {"error": error_json, "status_code": status_code, "url_attempted": url}
-            except:
-                return {"error": response_text, "status_code": status_code, "url_attempted": url}
-        except:
-            raise Exception(f"Product shot generation failed: {str(e)}")
+        return {"error": str(e), "status_code": 400, "url_attempted": url}
+
+async def generate_product_shot(
+    api_key: str,
+    image_data: Union[bytes, str],  # Raw bytes, base64 string (with data: prefix) or URL
+    ref_image_data: str,  # Base64 string (with data: prefix) or URL
+    scene_description: str = None,
+    gemini_api_key: str = None,  # For Smart Prompt Merger
+    num_results: int = 4,
+    sync: bool = False,
+    force_rmbg: bool = False,
+    content_moderation: bool = False
+) -> Dict[str, Any]:
+    """
+    Generate a lifestyle shot using Bria's best available endpoint.
+    If BOTH prompt and reference are provided, uses Gemini to merge them.
+    """
+    url, headers, data = await _build_product_shot_request(
+        api_key, image_data, ref_image_data, scene_description, gemini_api_key,
+        num_results, sync, force_rmbg, content_moderation
+    )
+    # The payload carries multi-MB base64 images; serialize off the event loop
+    body = await asyncio.to_thread(orjson.dumps, data)
+    return await _post_product_shot(url, headers, body)
 
-def lifestyle_shot_by_image(
+async def generate_product_shot_parallel(
+    api_key: str,
+    image_data: Union[bytes, str],  # Raw bytes, base64 string (with data: prefix) or URL
+    ref_image_data: str,  # Base64 string (with data: prefix) or URL
+    scene_description: str = None,
+    gemini_api_key: str = None,  # For Smart Prompt Merger
+    num_results: int = 4,
+    sync: bool = False,
+    force_rmbg: bool = False,
+    content_moderation: bool = False
+) -> Dict[str, Any]:
+    """
+    Same as generate_product_shot, but for sync requests with num_results > 1
+    fans out num_results single-result calls concurrently and merges their URLs,
+    so the wait is the slowest single generation rather than the whole batch.
+    Calls that failed while others succeeded are listed under "errors".
+    """
+    if not sync or num_results <= 1:
+        return await generate_product_shot(
+            api_key, image_data, ref_image_data, scene_description, gemini_api_key,
+            num_results, sync, force_rmbg, content_moderation
+        )
+
+    url, headers, data = await _build_product_shot_request(
+        api_key, image_data, ref_image_data, scene_description, gemini_api_key,
+        1, sync, force_rmbg, content_moderation
+    )
+    # Every call sends the same payload: serialize it once
+    body = await asyncio.to_thread(orjson.dumps, data)
+    results = await asyncio.gather(*[_post_product_shot(url, headers, body) for _ in range(num_results)])
+
+    urls = []
+    errors = []
+    for result in results:
+        urls.extend(extract_urls(result))
+        if isinstance(result, dict) and "error" in result:
+            errors.append(result)
+    if not urls:
+        # Nothing usable came back; surface the first error (or raw result) as-is
+        return errors[0] if errors else results[0]
+    merged = {"result_urls": urls}
+    if errors:
+        merged["errors"] = errors
+    return merged
+
+async def lifestyle_shot_by_image(
     api_key: str,
     image_data: bytes,
     reference_image: bytes,
@@ -334,8 +488,10 @@ def lifestyle_shot_by_image(
     }
     
     # Convert images to base64
-    image_base64 = base64.b64encode(image_data).decode('utf-8')
-    reference_base64 = base64.b64encode(reference_image).decode('utf-8')
+    image_base64, reference_base64 = await asyncio.gather(
+        asyncio.to_thread(lambda: base64.b64encode(image_data).decode('ascii')),
+        asyncio.to_thread(lambda: base64.b64encode(reference_image).decode('ascii'))
+    )
     
     # Prepare request data
     data = {
@@ -375,12 +531,12 @@ def lifestyle_shot_by_image(
         print(f"Headers: {headers}")
         print(f"Data: {data}")
         
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
-        
-        print(f"Response status: {response.status_code}")
-        print(f"Response body: {response.text}")
-        
-        return response.json()
+        async with get_session().post(url, headers=headers, data=orjson.dumps(data)) as response:
+            response.raise_for_status()
+            
+            print(f"Response status: {response.status}")
+            print(f"Response body: {await response.text()}")
+            
+            return await response.json(content_type=None, loads=orjson.loads)
     except Exception as e:
         raise Exception(f"Lifestyle shot generation failed: {str(e)}") 
\ No newline at end of file
@@ -1,6 +1,7 @@
 from typing import Dict, Any
-import requests
+import orjson
 import base64
+from utils.http_client import BRIA_SESSION
 
 def create_packshot(
     api_key: str,
@@ -52,7 +53,7 @@ def create_packshot(
         print(f"Headers: {headers}")
         print(f"Data keys: {list(data.keys())}")
         
-        response = requests.post(url, headers=headers, json=data)
+        response = BRIA_SESSION.post(url, headers=headers, data=orjson.dumps(data))
         response.raise_for_status()
         
         print(f"Response status: {response.status_code}")
@@ -1,6 +1,6 @@
 from typing import Dict, Any, Optional
-import requests
-import json
+import orjson
+from utils.http_client import BRIA_SESSION
 
 def enhance_prompt(
     api_key: str,
@@ -35,7 +35,7 @@ def enhance_prompt(
         print(f"Making request to: {url}")
         print(f"Headers: {headers}")
         
-        response = requests.post(url, headers=headers, json=data)
+        response = BRIA_SESSION.post(url, headers=headers, data=orjson.dumps(data))
         response.raise_for_status()
         
         print(f"Response status: {response.status_code}")
@@ -1,36 +1,261 @@
-import requests
-import json
+import httpx
+import orjson
 import time
 import os
-import base64
+import random
+import threading
+import hashlib
+import tempfile
+import asyncio
+import aiohttp
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
 from typing import Optional, Dict, Any, Union
-from utils.image_utils import image_to_base64
+from utils.image_utils import image_to_data_uri, sniff_image_mime, to_jpeg
+from utils.http_client import get_session
 
-def get_puter_token() -> Optional[str]:
+PUTER_DRIVER_URL = "https://api.puter.com/drivers/call"
+
+# Browser-like headers to avoid 403 on the temporary signup
+_BROWSER_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Origin": "https://puter.com",
+    "Referer": "https://puter.com/"
+}
+
+# One HTTP/2 connection per host (puter.com, api.puter.com): the signup, concurrent
+# driver calls and their retries multiplex as streams over a single TLS session.
+# Retries cover connection failures only, as the urllib3 Retry did for POSTs.
+_CLIENT = httpx.Client(
+    headers=_BROWSER_HEADERS,
+    timeout=httpx.Timeout(300, connect=10),
+    transport=httpx.HTTPTransport(
+        http2=True,
+        retries=3,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=16)
+    )
+)
+
+# Video generation can take time, though usually this returns a job
+_ASYNC_DRIVER_TIMEOUT = aiohttp.ClientTimeout(total=300)
+
+# Temporary tokens are reused for ~50 minutes (minus jitter) instead of
+# signing up again before every generation
+PUTER_TOKEN_TTL = 3000
+_token_cache = {"token": None, "expires_at": 0.0, "blocked_until": 0.0}
+_token_lock = threading.Lock()
+# A 403 from /signup won't clear in the next few seconds; don't hammer it
+SIGNUP_FORBIDDEN_TTL = 30
+
+def get_puter_token(force_refresh: bool = False) -> Optional[str]:
     """
     Get a temporary Puter.js token (No sign-up required).
+    Cached in-process; pass force_refresh=True after a 401.
     """
+    with _token_lock:
+        now = time.monotonic()
+        if not force_refresh and _token_cache["token"] and now < _token_cache["expires_at"]:
+            return _token_cache["token"]
+        if now < _token_cache["blocked_until"]:
+            return None
+        token = _signup_puter_token()
+        if token:
+            _token_cache["token"] = token
+            _token_cache["expires_at"] = time.monotonic() + PUTER_TOKEN_TTL - random.uniform(0, 120)
+        else:
+            _token_cache["token"] = None
+            _token_cache["expires_at"] = 0.0
+        return token
+
+def _signup_puter_token() -> Optional[str]:
     try:
-        # Improved headers to avoid 403
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Origin": "https://puter.com",
-            "Referer": "https://puter.com/"
-        }
         # Based on research, Puter allows temporary signup
-        response = requests.post(
+        response = _CLIENT.post(
             "https://puter.com/signup", 
-            json={"is_temp": True},
-            headers=headers,
+            headers={"Content-Type": "application/json"},
+            content=orjson.dumps({"is_temp": True}),
             timeout=10
         )
+        if response.status_code == 403:
+            _token_cache["blocked_until"] = time.monotonic() + SIGNUP_FORBIDDEN_TTL
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
         return data.get('token')
     except Exception as e:
         print(f"Error getting Puter token: {e}")
         return None
 
+# Finished videos keyed by (image, prompt, model, test_mode): re-running the same
+# shot while iterating on CTA copy skips the remote call. Disk-backed so it
+# survives restarts; disabled when diskcache isn't installed.
+VIDEO_CACHE_TTL = 7 * 24 * 3600
+_VIDEO_CACHE = diskcache.Cache(os.path.join(tempfile.gettempdir(), "rapidad_video_cache"), size_limit=2 * 1024**3) if diskcache else None
+
+# Paths are short; anything longer is an encoded image, so skip the stat()
+_MAX_PATH_LEN = 4096
+
+def _is_local_path(image_data: Any) -> bool:
+    if not isinstance(image_data, str) or image_data.startswith(('http://', 'https://', 'data:')):
+        return False
+    return len(image_data) < _MAX_PATH_LEN and os.path.exists(image_data)
+
+def _image_fingerprint(image_data: Any) -> str:
+    if isinstance(image_data, bytes):
+        return hashlib.blake2b(image_data, digest_size=16).hexdigest()
+    if _is_local_path(image_data):
+        # Local file: key on path + mtime + size instead of hashing the contents
+        st = os.stat(image_data)
+        image_data = f"{image_data}:{st.st_mtime_ns}:{st.st_size}"
+    return hashlib.blake2b(str(image_data).encode('utf-8'), digest_size=16).hexdigest()
+
+def _video_cache_key(image_data: Any, prompt: str, model: str, test_mode: bool) -> str:
+    return f"{_image_fingerprint(image_data)}|{prompt}|{model}|{test_mode}"
+
+# Failed generations (content filter, driver errors, timeouts) are remembered
+# briefly so an immediate retry of the same input fails fast instead of
+# waiting out another slow remote call
+ERROR_CACHE_TTL = 60
+_error_cache: Dict[str, tuple] = {}
+_error_lock = threading.Lock()
+
+def _lookup_result(key: str) -> Optional[Dict[str, Any]]:
+    with _error_lock:
+        hit = _error_cache.get(key)
+        if hit is not None:
+            if time.monotonic() - hit[0] < ERROR_CACHE_TTL:
+                return hit[1]
+            del _error_cache[key]
+    return _VIDEO_CACHE.get(key) if _VIDEO_CACHE is not None else None
+
+def _remember_result(key: str, result: Dict[str, Any]) -> Dict[str, Any]:
+    if "error" in result:
+        with _error_lock:
+            now = time.monotonic()
+            for stale in [k for k, (ts, _) in _error_cache.items() if now - ts >= ERROR_CACHE_TTL]:
+                del _error_cache[stale]
+            _error_cache[key] = (now, result)
+        return result
+    # Only successes with a fetchable URL; inline data: videos are too large to keep
+    url = result.get("video_url")
+    if _VIDEO_CACHE is not None and isinstance(url, str) and url.startswith('http'):
+        _VIDEO_CACHE.set(key, result, expire=VIDEO_CACHE_TTL)
+    return result
+
+# Whether /drivers/call accepted a multipart image upload; None until first tried.
+# Once rejected we go straight to the base64 data-URI payload.
+_MULTIPART_SUPPORTED = None
+_MULTIPART_REJECTED_STATUSES = (400, 413, 415, 422)
+
+# JSON bodies above this (a data-URI payload) are streamed in chunks instead of
+# being handed to the transport as one buffer
+_STREAM_BODY_THRESHOLD = 10 * 1024 * 1024
+_STREAM_CHUNK = 64 * 1024
+
+def _iter_body(body: bytes):
+    view = memoryview(body)
+    for i in range(0, len(view), _STREAM_CHUNK):
+        yield view[i:i + _STREAM_CHUNK]
+
+def _json_body(payload: Dict[str, Any], headers: Dict[str, str]):
+    # Serialize once with the C encoder: the payload may carry a multi-MB data URI
+    body = orjson.dumps(payload)
+    headers["Content-Type"] = "application/json"
+    if len(body) > _STREAM_BODY_THRESHOLD:
+        # httpx frames an iterator itself (chunked on HTTP/1.1, DATA frames on HTTP/2)
+        return _iter_body(body)
+    headers["Content-Length"] = str(len(body))
+    return body
+
+def _note_multipart_result(use_multipart: bool, result: Dict[str, Any]) -> None:
+    # A 2xx alone doesn't prove the driver read the file part (it may answer
+    # with an error body), so only a parsed video URL settles it
+    global _MULTIPART_SUPPORTED
+    if use_multipart and _MULTIPART_SUPPORTED is None and "video_url" in result:
+        _MULTIPART_SUPPORTED = True
+
+def _post_driver(token: str, payload: Dict[str, Any], image_bytes: Optional[bytes] = None) -> httpx.Response:
+    headers = {"Authorization": f"Bearer {token}"}
+    if image_bytes is None:
+        return _CLIENT.post(
+            PUTER_DRIVER_URL,
+            headers=headers,
+            content=_json_body(payload, headers),
+            timeout=300 # Video generation can take time, though usually this returns a job
+        )
+    # Raw image as a file part (no base64 inflation); the call itself rides along as JSON
+    return _CLIENT.post(
+        PUTER_DRIVER_URL,
+        headers=headers,
+        data={"payload": orjson.dumps(payload).decode('utf-8')},
+        files={"image": (_upload_name(image_bytes), image_bytes, sniff_image_mime(image_bytes))},
+        timeout=300
+    )
+
+def _call_driver(token: str, payload: Dict[str, Any], image_bytes: Optional[bytes] = None) -> httpx.Response:
+    response = _post_driver(token, payload, image_bytes)
+    if response.status_code == 401:
+        # Cached token was revoked/expired server-side: refresh once and retry
+        token = get_puter_token(force_refresh=True)
+        if token:
+            response = _post_driver(token, payload, image_bytes)
+    return response
+
+def _upload_name(image_bytes: bytes) -> str:
+    return "image." + sniff_image_mime(image_bytes).split("/")[1]
+
+def _prepare_image_url(image_data: Any, raw_image: Optional[bytes], use_multipart: bool) -> Optional[str]:
+    if raw_image is not None:
+        # Fallback: Puter also accepts the image inline as a data URI
+        return None if use_multipart else image_to_data_uri(raw_image)
+    if _is_local_path(image_data):
+        return image_to_data_uri(image_data)
+    return image_data # Already a URL / data URI, or a bare base64 string
+
+def _build_payload(prompt: str, model: str, test_mode: bool, image_url: Optional[str]) -> Dict[str, Any]:
+    # Puter.js txt2vid parameters
+    payload = {
+        "interface": "puter-txt2vid",
+        "driver": "openai-txt2vid", # The wrapper driver for AI services
+        "method": "txt2vid",
+        "args": {
+            "prompt": prompt,
+            "model": model,
+            "test_mode": test_mode
+        }
+    }
+    if image_url is not None:
+        payload["args"]["image_url"] = image_url
+    return payload
+
+def _parse_result(result: Any) -> Dict[str, Any]:
+    # Based on Puter.js behavior, the result might contain the URL or a message
+    # If it returns a result object, extract the URL
+    if isinstance(result, dict):
+        if "result" in result:
+            inner_result = result["result"]
+            if isinstance(inner_result, str) and (inner_result.startswith('http') or inner_result.startswith('data:video')):
+                return {"video_url": inner_result}
+            elif isinstance(inner_result, dict) and "url" in inner_result:
+                return {"video_url": inner_result["url"]}
+
+        # If response is direct
+        if "url" in result:
+            return {"video_url": result["url"]}
+
+        if "error" in result:
+            return {"error": f"Puter API Error: {result['error']}"}
+
+    # If we got something but it's not a URL, return the full result for debugging
+    return {"error": f"Unexpected response format from Puter: {result}"}
+
+def _http_error_message(err_data: Any, fallback: str) -> str:
+    try:
+        return err_data.get('error', {}).get('message', fallback)
+    except:
+        return fallback
+
 def generate_video_with_puter(
     image_data: Any,
     prompt: str,
@@ -49,85 +274,143 @@ def generate_video_with_puter(
     Returns:
         Dict containing video_url or error message.
     """
+    global _MULTIPART_SUPPORTED
+    cache_key = _video_cache_key(image_data, prompt, model, test_mode)
+    cached = _lookup_result(cache_key)
+    if cached is not None:
+        return cached
+
     token = get_puter_token()
     if not token:
         return {"error": "Failed to authenticate with Puter.js (Temporary signup failed)."}
 
+    # Raw bytes are uploaded as multipart unless the driver has rejected that before
+    raw_image = to_jpeg(image_data) if isinstance(image_data, bytes) else None
+    use_multipart = raw_image is not None and _MULTIPART_SUPPORTED is not False
+
     # Prepare image data
     try:
-        if isinstance(image_data, bytes):
-            # Convert bytes to base64 for the API if needed, 
-            # but Puter might expect a URL. 
-            # If we have bytes, we might need to upload it or provide as data URI.
-            img_b64 = base64.b64encode(image_data).decode('utf-8')
-            image_url = f"data:image/png;base64,{img_b64}"
-        elif isinstance(image_data, str) and not image_data.startswith('http'):
-            # Assume it's already a data URI or path
-            if os.path.exists(image_data):
-                img_b64 = image_to_base64(image_data)
-                image_url = f"data:image/png;base64,{img_b64}"
-            else:
-                image_url = image_data # Could be base64 string
-        else:
-            image_url = image_data # Already a URL
+        image_url = _prepare_image_url(image_data, raw_image, use_multipart)
     except Exception as e:
         return {"error": f"Failed to process image data: {str(e)}"}
 
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
-
-    # Puter.js txt2vid parameters
-    payload = {
-        "interface": "puter-txt2vid",
-        "driver": "openai-txt2vid", # The wrapper driver for AI services
-        "method": "txt2vid",
-        "args": {
-            "prompt": prompt,
-            "model": model,
-            "image_url": image_url,
-            "test_mode": test_mode
-        }
-    }
+    payload = _build_payload(prompt, model, test_mode, image_url)
 
     try:
         print(f"🎬 Calling Puter.js driver: {model}...")
-        response = requests.post(
-            "https://api.puter.com/drivers/call",
-            headers=headers,
-            json=payload,
-            timeout=300 # Video generation can take time, though usually this returns a job
-        )
+        if use_multipart:
+            response = _call_driver(token, payload, raw_image)
+            if response.status_code in _MULTIPART_REJECTED_STATUSES:
+                print("Puter rejected multipart upload, falling back to base64 data URI...")
+                _MULTIPART_SUPPORTED = False
+                payload["args"]["image_url"] = image_to_data_uri(raw_image)
+                response = _call_driver(get_puter_token() or token, payload)
+        else:
+            response = _call_driver(token, payload)
         response.raise_for_status()
-        result = response.json()
-        
-        # Based on Puter.js behavior, the result might contain the URL or a message
-        # If it returns a result object, extract the URL
-        if isinstance(result, dict):
-            if "result" in result:
-                inner_result = result["result"]
-                if isinstance(inner_result, str) and (inner_result.startswith('http') or inner_result.startswith('data:video')):
-                    return {"video_url": inner_result}
-                elif isinstance(inner_result, dict) and "url" in inner_result:
-                    return {"video_url": inner_result["url"]}
-            
-            # If response is direct
-            if "url" in result:
-                return {"video_url": result["url"]}
-            
-            if "error" in result:
-                return {"error": f"Puter API Error: {result['error']}"}
-        
-        # If we got something but it's not a URL, return the full result for debugging
-        return {"error": f"Unexpected response format from Puter: {result}"}
+        result = _parse_result(orjson.loads(response.content))
+        _note_multipart_result(use_multipart, result)
+        return _remember_result(cache_key, result)
 
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         try:
-            err_data = e.response.json()
-            err_msg = err_data.get('error', {}).get('message', str(e))
+            err_msg = _http_error_message(orjson.loads(e.response.content), str(e))
         except:
             err_msg = str(e)
-        return {"error": f"Puter API HTTP Error: {err_msg}"}
+        return _remember_result(cache_key, {"error": f"Puter API HTTP Error: {err_msg}"})
+    except Exception as e:
+        return _remember_result(cache_key, {"error": f"Failed to generate video with Puter: {str(e)}"})
+
+async def _post_driver_async(token: str, payload: Dict[str, Any], image_bytes: Optional[bytes] = None):
+    """POST to the driver on the shared aiohttp session; returns (status, body bytes)."""
+    headers = {**_BROWSER_HEADERS, "Authorization": f"Bearer {token}"}
+    if image_bytes is None:
+        # May embed a multi-MB data URI: serialize in a worker thread
+        body = await asyncio.to_thread(orjson.dumps, payload)
+        headers["Content-Type"] = "application/json"
+        headers["Content-Length"] = str(len(body))
+        kwargs = {"data": body}
+    else:
+        form = aiohttp.FormData()
+        # A str value keeps "payload" a plain form field, same as the sync path
+        form.add_field("payload", orjson.dumps(payload).decode('utf-8'))
+        form.add_field("image", image_bytes, filename=_upload_name(image_bytes), content_type=sniff_image_mime(image_bytes))
+        kwargs = {"data": form}
+    async with get_session().post(PUTER_DRIVER_URL, headers=headers, timeout=_ASYNC_DRIVER_TIMEOUT, **kwargs) as resp:
+        return resp.status, await resp.read()
+
+async def _call_driver_async(token: str, payload: Dict[str, Any], image_bytes: Optional[bytes] = None):
+    status, body = await _post_driver_async(token, payload, image_bytes)
+    if status == 401:
+        token = await asyncio.to_thread(get_puter_token, True)
+        if token:
+            status, body = await _post_driver_async(token, payload, image_bytes)
+    return status, body
+
+async def generate_video_with_puter_async(
+    image_data: Any,
+    prompt: str,
+    model: str = "Wan-AI/Wan2.2-I2V-A14B",
+    test_mode: bool = False
+) -> Dict[str, Any]:
+    """
+    Async variant of generate_video_with_puter, so several generations can be
+    in flight at once (see services.video_generator.generate_videos_batch).
+    """
+    global _MULTIPART_SUPPORTED
+    # Hashing, diskcache (SQLite) and base64 work all run off the event loop
+    cache_key = await asyncio.to_thread(_video_cache_key, image_data, prompt, model, test_mode)
+    cached = await asyncio.to_thread(_lookup_result, cache_key)
+    if cached is not None:
+        return cached
+
+    # Signup is rare (the token is cached) and guarded by a thread lock
+    token = await asyncio.to_thread(get_puter_token)
+    if not token:
+        return {"error": "Failed to authenticate with Puter.js (Temporary signup failed)."}
+
+    try:
+        raw_image = await asyncio.to_thread(to_jpeg, image_data) if isinstance(image_data, bytes) else None
+        use_multipart = raw_image is not None and _MULTIPART_SUPPORTED is not False
+        image_url = await asyncio.to_thread(_prepare_image_url, image_data, raw_image, use_multipart)
     except Exception as e:
-        return {"error": f"Failed to generate video with Puter: {str(e)}"}
+        return {"error": f"Failed to process image data: {str(e)}"}
+
+    payload = _build_payload(prompt, model, test_mode, image_url)
+
+    try:
+        print(f"🎬 Calling Puter.js driver: {model}...")
+        if use_multipart:
+            status, body = await _call_driver_async(token, payload, raw_image)
+            if status in _MULTIPART_REJECTED_STATUSES:
+                print("Puter rejected multipart upload, falling back to base64 data URI...")
+                _MULTIPART_SUPPORTED = False
+                payload["args"]["image_url"] = await asyncio.to_thread(image_to_data_uri, raw_image)
+                # The first call may have refreshed the token after a 401
+                status, body = await _call_driver_async(await asyncio.to_thread(get_puter_token) or token, payload)
+        else:
+            status, body = await _call_driver_async(token, payload)
+
+        if status >= 400:
+            fallback = f"{status} error from {PUTER_DRIVER_URL}"
+            try:
+                err_msg = _http_error_message(orjson.loads(body), fallback)
+            except:
+                err_msg = fallback
+            result = {"error": f"Puter API HTTP Error: {err_msg}"}
+        else:
+            result = _parse_result(orjson.loads(body))
+            _note_multipart_result(use_multipart, result)
+    except Exception as e:
+        result = {"error": f"Failed to generate video with Puter: {str(e)}"}
+    return await asyncio.to_thread(_remember_result, cache_key, result)
+
+def _prewarm():
+    # Resolve DNS and open the HTTP/2 connection to the driver host before the
+    # first generation needs it; failures just mean a cold first call
+    try:
+        _CLIENT.head("https://api.puter.com/", timeout=2)
+    except Exception:
+        pass
+
+threading.Thread(target=_prewarm, daemon=True).start()
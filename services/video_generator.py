@@ -1,8 +1,41 @@
-import time
+import io
 import os
+import asyncio
+import hashlib
+import threading
+import socket
+from functools import lru_cache
+import httpx
 import replicate
-import requests
-from typing import Optional, Dict, Any
+from cachetools import TTLCache
+from typing import Optional, Dict, Any, List
+from utils.image_utils import to_jpeg
+from .puter_video import generate_video_with_puter_async
+
+@lru_cache(maxsize=8)
+def _replicate_client(api_token: str) -> replicate.Client:
+    # One client per token: thread-safe (no shared env var) and its HTTP pool
+    # stays warm across the prediction status polls of successive jobs.
+    # Over HTTP/2 those polls and new submissions share one TLS connection.
+    return replicate.Client(api_token=api_token, transport=httpx.HTTPTransport(http2=True))
+
+# Uploaded-file URLs keyed by (token, content hash), so regenerating the same
+# shot with a new prompt skips the upload. Kept well inside Replicate's file expiry.
+_UPLOAD_CACHE = TTLCache(maxsize=64, ttl=3600)
+_UPLOAD_LOCK = threading.Lock()
+
+def _upload_image(client: replicate.Client, api_token: str, image_bytes: bytes) -> str:
+    """Upload once via the files API and return the file URL for the model input."""
+    key = (api_token, hashlib.blake2b(image_bytes, digest_size=16).hexdigest())
+    with _UPLOAD_LOCK:
+        url = _UPLOAD_CACHE.get(key)
+    if url:
+        return url
+    file_obj = client.files.create(file=io.BytesIO(to_jpeg(image_bytes)))
+    url = file_obj.urls["get"]
+    with _UPLOAD_LOCK:
+        _UPLOAD_CACHE[key] = url
+    return url
 
 def generate_video_with_replicate(
     api_token: str,
@@ -13,14 +46,12 @@ def generate_video_with_replicate(
     Generate a video from a lifestyle shot using Replicate (Stable Video Diffusion).
     """
     try:
-        # Set API Token
-        os.environ["REPLICATE_API_TOKEN"] = api_token
-        
+        client = _replicate_client(api_token)
+
         # Prepare the image. Replicate's SDK can take a file handle or URL.
-        # If it's bytes, we need to provide a file-like object.
-        import io
+        # Bytes are uploaded once up front so run() retries never re-send them.
         if isinstance(image_data, bytes):
-            image_input = io.BytesIO(image_data)
+            image_input = _upload_image(client, api_token, image_data)
         else:
             image_input = image_data
 
@@ -30,7 +61,7 @@ def generate_video_with_replicate(
         model_name = "wavespeedai/wan-2.1-i2v-480p"
         
         # Run the model
-        output = replicate.run(
+        output = client.run(
             model_name,
             input={
                 "image": image_input,
@@ -57,3 +88,48 @@ def generate_video_with_replicate(
         elif "authentication" in error_str.lower():
             return {"error": "❌ **Authentication Failed**: Please check your Replicate API Token."}
         return {"error": f"Failed to generate video (Replicate): {error_str}"}
+
+async def generate_video_with_replicate_async(
+    api_token: str,
+    image_data: Any,
+    prompt: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Async wrapper: the Replicate SDK blocks while it polls, so run it in a worker thread.
+    """
+    return await asyncio.to_thread(generate_video_with_replicate, api_token, image_data, prompt)
+
+async def generate_videos_batch(jobs: List[Dict[str, Any]]) -> List[Any]:
+    """
+    Generate several ad videos concurrently.
+
+    Args:
+        jobs: One dict per video. "provider" is "puter" (default) or "replicate";
+              the remaining keys are passed to the matching generator, e.g.
+              {"provider": "replicate", "api_token": ..., "image_data": ..., "prompt": ...}
+
+    Returns:
+        Results in job order. A job that raised yields its exception instead of a dict.
+    """
+    return await asyncio.gather(*(_run_job(job) for job in jobs), return_exceptions=True)
+
+async def _run_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    kwargs = dict(job)
+    provider = kwargs.pop("provider", "puter")
+    if provider == "replicate":
+        return await generate_video_with_replicate_async(**kwargs)
+    return await generate_video_with_puter_async(**kwargs)
+
+def _prewarm():
+    # With a server-side token, warm the very client the first job will reuse;
+    # otherwise (token comes from the UI) at least resolve the API host
+    try:
+        token = os.environ.get("REPLICATE_API_TOKEN")
+        if token:
+            _replicate_client(token).accounts.current()
+        else:
+            socket.getaddrinfo("api.replicate.com", 443)
+    except Exception:
+        pass
+
+threading.Thread(target=_prewarm, daemon=True).start()
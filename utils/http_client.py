@@ -0,0 +1,139 @@
+import asyncio
+import ipaddress
+import socket
+from urllib.parse import urljoin, urlparse
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+_SESSION = None
+_SESSION_LOOP = None
+# Separate session for user-supplied URLs: its resolver vets every address it dials
+_PUBLIC_SESSION = None
+_PUBLIC_SESSION_LOOP = None
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Return the shared aiohttp session, creating it on first use.
+    Must be called from inside a running event loop.
+    """
+    global _SESSION, _SESSION_LOOP
+    loop = asyncio.get_running_loop()
+    if _SESSION is None or _SESSION.closed or _SESSION_LOOP is not loop:
+        connector = aiohttp.TCPConnector(limit=100, limit_per_host=20)
+        _SESSION = aiohttp.ClientSession(connector=connector)
+        _SESSION_LOOP = loop
+    return _SESSION
+
+def _is_public_address(address: str) -> bool:
+    return ipaddress.ip_address(address.split('%')[0]).is_global
+
+class PublicOnlyResolver(aiohttp.abc.AbstractResolver):
+    """
+    Resolver that refuses hosts with any non-public address. Because the check
+    runs on the addresses the connector actually dials, a DNS answer that
+    changes between a pre-check and the connect (rebinding) can't slip through.
+    """
+    def __init__(self):
+        self._resolver = aiohttp.ThreadedResolver()
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        infos = await self._resolver.resolve(host, port, family)
+        if not infos or not all(_is_public_address(info['host']) for info in infos):
+            raise OSError(f"{host} does not resolve to a public address")
+        return infos
+
+    async def close(self):
+        await self._resolver.close()
+
+def _get_public_session() -> aiohttp.ClientSession:
+    global _PUBLIC_SESSION, _PUBLIC_SESSION_LOOP
+    loop = asyncio.get_running_loop()
+    if _PUBLIC_SESSION is None or _PUBLIC_SESSION.closed or _PUBLIC_SESSION_LOOP is not loop:
+        connector = aiohttp.TCPConnector(limit=100, limit_per_host=20, resolver=PublicOnlyResolver())
+        _PUBLIC_SESSION = aiohttp.ClientSession(connector=connector)
+        _PUBLIC_SESSION_LOOP = loop
+    return _PUBLIC_SESSION
+
+def make_retry_session(
+    pool_connections: int = 20,
+    pool_maxsize: int = 50,
+    status_forcelist=(502, 503, 504)
+) -> requests.Session:
+    """
+    Build a requests.Session that keeps connections alive and retries transient failures.
+    """
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.3, status_forcelist=list(status_forcelist))
+    session.mount('https://', HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry))
+    return session
+
+# Shared by the synchronous Bria services so they reuse TLS connections
+BRIA_SESSION = make_retry_session()
+
+_REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+def is_http_url(url):
+    """Cheap syntactic check, done before any DNS/TCP work"""
+    if not isinstance(url, str):
+        return False
+    try:
+        parsed = urlparse(url)
+        parsed.port  # raises ValueError for out-of-range or non-numeric ports
+    except (TypeError, ValueError):
+        return False
+    return parsed.scheme in ('http', 'https') and bool(parsed.hostname)
+
+async def resolves_to_public_ip(url):
+    """Reject hosts that resolve to private/loopback/link-local addresses (SSRF)"""
+    try:
+        parsed = urlparse(url)
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        infos = await asyncio.get_running_loop().getaddrinfo(parsed.hostname, port, type=socket.SOCK_STREAM)
+    except (OSError, ValueError):
+        return False
+    return bool(infos) and all(_is_public_address(info[4][0]) for info in infos)
+
+async def fetch_public_url(url, max_bytes, timeout, headers=None, max_redirects=5):
+    """
+    GET a user-supplied URL on the public-only session.
+    Every hop, redirects included, must resolve to a public address -- checked up
+    front (IP-literal hosts never reach a resolver) and again by PublicOnlyResolver
+    on the addresses actually dialled. The body is
+    capped at max_bytes while streaming. Returns (response, body), with body None
+    for a 304. Raises ValueError for refused URLs and aiohttp errors for bad statuses.
+    """
+    for _ in range(max_redirects + 1):
+        if not is_http_url(url) or not await resolves_to_public_ip(url):
+            raise ValueError(f"{url} does not resolve to a public address")
+        async with _get_public_session().get(url, headers=headers, timeout=timeout, allow_redirects=False) as response:
+            location = response.headers.get('Location')
+            if response.status in _REDIRECT_STATUSES and location:
+                url = urljoin(url, location)
+                continue
+            if response.status == 304:
+                return response, None
+            response.raise_for_status()
+            if (response.content_length or 0) > max_bytes:
+                raise ValueError(f"image larger than {max_bytes} bytes")
+            # Count while streaming; Content-Length may be absent or wrong
+            chunks, size = [], 0
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ValueError(f"image larger than {max_bytes} bytes")
+                chunks.append(chunk)
+            return response, b''.join(chunks)
+    raise ValueError(f"too many redirects fetching {url}")
+
+async def close_session():
+    """Close the shared sessions (called on app shutdown)."""
+    global _SESSION, _SESSION_LOOP, _PUBLIC_SESSION, _PUBLIC_SESSION_LOOP
+    for session in (_SESSION, _PUBLIC_SESSION):
+        if session is not None and not session.closed:
+            await session.close()
+    _SESSION = None
+    _SESSION_LOOP = None
+    _PUBLIC_SESSION = None
+    _PUBLIC_SESSION_LOOP = None
@@ -1,5 +1,11 @@
-import base64
+import io
 import os
+try:
+    import pybase64 as base64  # SIMD-accelerated drop-in for the stdlib module
+except ImportError:
+    import base64
+import jmespath
+from PIL import Image
 
 def image_to_base64(image_input):
     """
@@ -12,11 +18,102 @@ def image_to_base64(image_input):
         return base64.b64encode(image_input).decode('utf-8')
         
     if isinstance(image_input, str) and os.path.exists(image_input):
-        with open(image_input, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+        return _stream_b64(image_input)
             
     # If it's a file-like object (like Streamlit UploadedFile)
     if hasattr(image_input, "read"):
         return base64.b64encode(image_input.read()).decode('utf-8')
         
     return None
+
+# 48 KB is a multiple of 3, so each chunk encodes without padding
+_B64_CHUNK = 48 * 1024
+
+def _stream_b64(path, chunk=_B64_CHUNK, prefix=b""):
+    """Base64-encode a file chunk by chunk instead of reading it into memory whole."""
+    out = bytearray(prefix)
+    with open(path, "rb") as image_file:
+        while buf := image_file.read(chunk):
+            out += base64.b64encode(buf)
+    return out.decode('ascii')
+
+def image_to_data_uri(image_input, mime=None):
+    """
+    Convert image input (bytes, file path, or file-like object) to a base64 data URI.
+    The MIME type is sniffed from the magic bytes unless given.
+    """
+    if not image_input:
+        return None
+
+    # If it's a file-like object (like Streamlit UploadedFile)
+    if hasattr(image_input, "read"):
+        image_input = image_input.read()
+
+    if isinstance(image_input, bytes):
+        prefix = f"data:{mime or sniff_image_mime(image_input)};base64,".encode('ascii')
+        # Join as bytes and decode once: no extra multi-MB str copy
+        return b"".join((prefix, base64.b64encode(image_input))).decode('ascii')
+
+    if isinstance(image_input, str) and os.path.exists(image_input):
+        if mime is None:
+            with open(image_input, "rb") as image_file:
+                mime = sniff_image_mime(image_file.read(16))
+        return _stream_b64(image_input, prefix=f"data:{mime};base64,".encode('ascii'))
+
+    return None
+
+def to_jpeg(image_bytes, quality=85, min_size=256 * 1024):
+    """
+    Re-encode image bytes as JPEG to cut upload size (a 1024px PNG is ~10x larger).
+    Inputs that are already JPEG, smaller than min_size, or that PIL can't decode
+    (e.g. HEIC/AVIF without a plugin) are returned unchanged.
+    """
+    if len(image_bytes) < min_size or sniff_image_mime(image_bytes) == "image/jpeg":
+        return image_bytes
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+            # JPEG has no alpha; flatten cutouts onto white rather than black
+            img = img.convert("RGBA")
+            flat = Image.new("RGB", img.size, (255, 255, 255))
+            flat.paste(img, mask=img.getchannel("A"))
+            img = flat
+        else:
+            img = img.convert("RGB")
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=quality)
+    except Exception:
+        # Let the remote service decide what to do with it, as before
+        return image_bytes
+    return buffer.getvalue()
+
+def sniff_image_mime(image_bytes, default="image/png"):
+    """
+    Guess the MIME type of image bytes from their magic number.
+    """
+    if not image_bytes:
+        return default
+    if image_bytes.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if image_bytes.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if image_bytes.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "image/webp"
+    return default
+
+# Compiled once; each branch mirrors one of the Bria response shapes:
+# result_urls list, single result_url, result list (dicts with urls/url,
+# nested lists, or bare strings), and a plain urls list.
+_URL_EXPR = jmespath.compile("""
+    (type(result_urls) == 'array' && result_urls)
+    || (result_url && [result_url])
+    || (type(result) == 'array' && map(&(urls[0] || url || [0] || @), result)[?type(@) == 'string'])
+    || (type(urls) == 'array' && urls)
+""")
+
+def extract_urls(data):
+    """Robustly extract all image URLs from various Bria response formats"""
+    if not isinstance(data, dict): return []
+    return _URL_EXPR.search(data) or []
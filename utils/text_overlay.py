@@ -1,34 +1,59 @@
 from PIL import Image, ImageDraw, ImageFont
 import io
 import base64
+from functools import lru_cache
 
-def add_cta_to_image(image_bytes, headline, subheadline, position="bottom", text_color="#FFFFFF", bg_opacity=0.5):
+_FORMAT_ALIASES = {"JPG": "JPEG"}
+
+@lru_cache(maxsize=32)
+def _font(path, size):
+    """Load a TrueType font once per (path, size); falls back to PIL's default font."""
+    try:
+        return ImageFont.truetype(path, size)
+    except Exception:
+        return ImageFont.load_default()
+
+def _line_height(font, text):
+    # FreeType metrics need no glyph layout; bitmap fonts have no metrics, so measure
+    if isinstance(font, ImageFont.FreeTypeFont):
+        ascent, descent = font.getmetrics()
+        return ascent + descent
+    bbox = font.getbbox(text)
+    return bbox[3] - bbox[1]
+
+def _draw_centered(draw, xy, text, font, fill):
+    if isinstance(font, ImageFont.FreeTypeFont):
+        # Pillow centers on the anchor in the same layout pass it draws with
+        draw.text(xy, text, font=font, fill=fill, anchor="mm")
+    else:
+        # Bitmap fonts don't support anchors
+        bbox = font.getbbox(text)
+        draw.text((xy[0] - (bbox[2] - bbox[0]) / 2, xy[1] - (bbox[3] - bbox[1]) / 2), text, font=font, fill=fill)
+
+def add_cta_to_image(image_bytes, headline, subheadline, position="bottom", text_color="#FFFFFF", bg_opacity=0.5, output_format="JPEG"):
     """
     Overlay CTA text on an image using PIL.
+    output_format is "JPEG" (default, quality 90; "JPG" also accepted), "WEBP", or "PNG" when lossless output is needed.
     """
-    img = Image.open(io.BytesIO(image_bytes)).convert("RGBA")
-    draw = ImageDraw.Draw(img)
+    output_format = output_format.upper()
+    output_format = _FORMAT_ALIASES.get(output_format, output_format)
+    if output_format not in ("JPEG", "WEBP", "PNG"):
+        raise ValueError(f"Unsupported output_format: {output_format}")
+    src = Image.open(io.BytesIO(image_bytes))
+    # The output is RGB, so only keep alpha when the source actually has it
+    has_alpha = src.mode in ("RGBA", "LA") or (src.mode == "P" and "transparency" in src.info)
+    if has_alpha:
+        src = src.convert("RGBA")
+    img = src.convert("RGB")
     width, height = img.size
     
-    # Text overlay layer
-    overlay = Image.new('RGBA', img.size, (0,0,0,0))
-    d = ImageDraw.Draw(overlay)
-    
     # Try to load a font, fallback to default
-    try:
-        # Assuming a common font location or default
-        font_h = ImageFont.truetype("arial.ttf", int(height * 0.05))
-        font_s = ImageFont.truetype("arial.ttf", int(height * 0.03))
-    except:
-        font_h = ImageFont.load_default()
-        font_s = ImageFont.load_default()
+    font_h = _font("arial.ttf", int(height * 0.05))
+    font_s = _font("arial.ttf", int(height * 0.03))
     
     # Calculate positions
-    h_bbox = d.textbbox((0, 0), headline, font=font_h)
-    s_bbox = d.textbbox((0, 0), subheadline, font=font_s)
-    
-    h_w, h_h = h_bbox[2] - h_bbox[0], h_bbox[3] - h_bbox[1]
-    s_w, s_h = s_bbox[2] - s_bbox[0], s_bbox[3] - s_bbox[1]
+    h_h = _line_height(font_h, headline)
+    s_h = _line_height(font_s, subheadline)
     
     padding = 20
     rect_h = h_h + s_h + padding * 3
@@ -38,17 +63,28 @@ def add_cta_to_image(image_bytes, headline, subheadline, position="bottom", text
     else:
         rect_y = 0
         
-    # Draw background rectangle
-    d.rectangle([0, rect_y, width, rect_y + rect_h], fill=(0,0,0,int(255*bg_opacity)))
-    
-    # Draw text
-    d.text(((width - h_w)/2, rect_y + padding), headline, font=font_h, fill=text_color)
-    d.text(((width - s_w)/2, rect_y + h_h + padding * 2), subheadline, font=font_s, fill=text_color)
+    # Only the CTA band changes: darken just that strip, paste it back,
+    # then draw the opaque text straight onto the RGB base
+    box = (0, rect_y, width, rect_y + rect_h + 1)
+    if has_alpha:
+        # Transparent pixels take the band colour, as compositing "over" them would
+        band = Image.new('RGBA', (box[2], box[3] - box[1]), (0, 0, 0, int(255 * bg_opacity)))
+        strip = Image.alpha_composite(src.crop(box), band).convert("RGB")
+    else:
+        strip = img.crop(box)
+        strip = Image.blend(strip, Image.new("RGB", strip.size), bg_opacity)
+    img.paste(strip, box[:2])
     
-    # Combine
-    out = Image.alpha_composite(img, overlay).convert("RGB")
+    d = ImageDraw.Draw(img)
+    cx = width / 2
+    _draw_centered(d, (cx, rect_y + padding + h_h / 2), headline, font_h, text_color)
+    _draw_centered(d, (cx, rect_y + h_h + padding * 2 + s_h / 2), subheadline, font_s, text_color)
+    out = img
     
-    # Save to bytes
+    # Save to bytes. JPEG/WebP encode far faster than PNG's zlib pass on HD images
     buffer = io.BytesIO()
-    out.save(buffer, format="PNG")
+    if output_format == "PNG":
+        out.save(buffer, format="PNG")
+    else:
+        out.save(buffer, format=output_format, quality=90)
     return buffer.getvalue()